@@ -0,0 +1,75 @@
+import os
+from typing import NamedTuple, Optional
+
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class AwsCredentials(NamedTuple):
+    access_key: Optional[str]
+    secret_key: Optional[str]
+    region: Optional[str]
+
+
+# Credentials and region are read from the environment once into an immutable snapshot;
+# the session, every client below and the presigner are all built from it
+AWS_CREDENTIALS = AwsCredentials(
+    access_key=os.getenv("AWS_ACCESS_KEY"),
+    secret_key=os.getenv("AWS_SECRET_KEY"),
+    region=os.getenv("AWS_REGION")
+)
+
+aws_session = boto3.Session(
+    aws_access_key_id=AWS_CREDENTIALS.access_key,
+    aws_secret_access_key=AWS_CREDENTIALS.secret_key,
+    region_name=AWS_CREDENTIALS.region
+)
+
+# One connection pool per client for the whole process: wide enough for the thread-pool fan-outs,
+# with TCP keep-alive so bursts reuse warm connections instead of paying new TLS handshakes.
+# Adaptive retries also rate-limit the client when AWS throttles; short timeouts fail stuck calls fast.
+AWS_CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=10
+)
+
+# Requests go straight to the bucket's regional virtual-hosted endpoint ({bucket}.s3.{region}.amazonaws.com),
+# never through the global endpoint and its redirects
+S3_ENDPOINT_OPTIONS = {"addressing_style": "virtual", "us_east_1_regional_endpoint": "regional"}
+
+s3_client = aws_session.client(
+    "s3",
+    config=AWS_CLIENT_CONFIG.merge(Config(signature_version="s3v4", s3=S3_ENDPOINT_OPTIONS))
+)
+
+# Client-direct uploads can go through S3 Transfer Acceleration edge locations.
+# Only enable once PutBucketAccelerateConfiguration is set to Enabled on the bucket.
+S3_TRANSFER_ACCELERATION = os.getenv("S3_TRANSFER_ACCELERATION", "false").lower() == "true"
+
+s3_upload_client = aws_session.client(
+    "s3",
+    config=AWS_CLIENT_CONFIG.merge(
+        Config(signature_version="s3v4", s3={**S3_ENDPOINT_OPTIONS, "use_accelerate_endpoint": True})
+    )
+) if S3_TRANSFER_ACCELERATION else s3_client
+
+DAX_ENDPOINT = os.getenv("DAX_ENDPOINT")
+
+if DAX_ENDPOINT:
+    # DAX serves reads from its own item cache in front of the table
+    from amazondax import AmazonDaxClient
+
+    dynamodb = AmazonDaxClient.resource(
+        endpoint_url=DAX_ENDPOINT,
+        aws_access_key_id=AWS_CREDENTIALS.access_key,
+        aws_secret_access_key=AWS_CREDENTIALS.secret_key,
+        region_name=AWS_CREDENTIALS.region,
+    )
+else:
+    dynamodb = aws_session.resource("dynamodb", config=AWS_CLIENT_CONFIG)
@@ -1,19 +1,19 @@
-import os
-import boto3
+import threading
+
 from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
-from dotenv import load_dotenv
+from cachetools import TTLCache
 
-load_dotenv()
+from .aws_clients import dynamodb, DAX_ENDPOINT
 
-dynamodb = boto3.resource(
-    "dynamodb",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
-    region_name=os.getenv("AWS_REGION"),
-)
+# Created once at import time - never re-create the resource or table per request
+EVENTS_TABLE_NAME = "Events"
+events_table = dynamodb.Table(EVENTS_TABLE_NAME)
 
-events_table = dynamodb.Table("Events")
+# Without DAX, events are cached in-process for a short time - they rarely change within a session
+# (status changes are only invalidated in the worker that made them, so the TTL is what bounds staleness elsewhere)
+event_cache = TTLCache(maxsize=10_000, ttl=30)
+event_cache_lock = threading.Lock()
 
 
 def fetch_events_by_email(email: str):
@@ -36,6 +36,7 @@ def fetch_events_by_email(email: str):
 def get_event_by_id(event_id: str):
     """
     Fetch an event by its event_id from DynamoDB.
+    Found events are served from the in-process cache for up to 30 seconds (unless DAX is used).
 
     Args:
         event_id (str): The unique event ID.
@@ -43,12 +44,24 @@ def get_event_by_id(event_id: str):
     Returns:
         dict: The event data.
     """
+    if not DAX_ENDPOINT:
+        with event_cache_lock:
+            event = event_cache.get(event_id)
+        if event is not None:
+            return event
+
     try:
-        response = events_table.get_item(Key={"event_id": event_id})
-        return response.get("Item")
+        response = events_table.get_item(Key={"event_id": event_id}, ConsistentRead=False)
+        event = response.get("Item")
     except Exception as e:
         raise Exception(f"Error fetching event by ID: {str(e)}")
 
+    if event is not None and not DAX_ENDPOINT:
+        with event_cache_lock:
+            event_cache[event_id] = event
+
+    return event
+
 
 def save_event(event_item: dict):
     """
@@ -82,6 +95,8 @@ def update_event_status(event_id: str, status: str):
             ReturnValues="UPDATED_NEW"
         )
         print(f"Event status updated successfully for event_id {event_id}: {response}")
+        with event_cache_lock:
+            event_cache.pop(event_id, None)
     except ClientError as e:
         print(f"Error updating event status: {e}")
         raise
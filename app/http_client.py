@@ -0,0 +1,18 @@
+import httpx
+from fastapi import Request
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Create the process-wide HTTP client used for all outbound API calls (PayPal, Twilio).
+    Its keep-alive pool lets consecutive requests skip the DNS/TCP/TLS setup.
+    """
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300)
+    )
+
+
+def get_http(request: Request) -> httpx.AsyncClient:
+    """ Dependency returning the shared HTTP client created in the app's lifespan. """
+    return request.app.state.http
@@ -1,10 +1,25 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
+from .http_client import create_http_client
+from .redis_service import async_redis_client
 from .routers import events, guests, albums, auth, payment
 
-# Initialize the FastAPI app
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client for the whole process, closed on shutdown
+    app.state.http = create_http_client()
+    yield
+    await app.state.http.aclose()
+    await async_redis_client.aclose()
+
+
+# Initialize the FastAPI app - responses are serialized with orjson instead of the stdlib json module
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS configuration - Allow frontend to interact with backend
 app.add_middleware(
@@ -0,0 +1,102 @@
+import os
+import time
+
+import httpx
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Live REST API
+PAYPAL_API_BASE_URL = "https://api-m.paypal.com"
+PAYPAL_CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
+PAYPAL_CLIENT_SECRET = os.getenv("PAYPAL_CLIENT_SECRET")
+
+# Refresh the OAuth token this many seconds before PayPal expires it
+ACCESS_TOKEN_EXPIRY_MARGIN = 60
+
+# Cached OAuth access token, shared by all requests in the process
+_access_token = {"token": None, "expires_at": 0.0}
+
+
+async def get_access_token(client: httpx.AsyncClient) -> str:
+    """
+    Return a PayPal OAuth access token, requesting a new one only when the cached token expired.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client.
+
+    Returns:
+        str: The bearer access token.
+    """
+    if _access_token["token"] and _access_token["expires_at"] > time.time():
+        return _access_token["token"]
+
+    response = await client.post(
+        f"{PAYPAL_API_BASE_URL}/v1/oauth2/token",
+        data={"grant_type": "client_credentials"},
+        auth=(PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET)
+    )
+    if response.status_code != 200:
+        raise Exception(f"Error fetching PayPal access token: {response.text}")
+
+    token_data = orjson.loads(response.content)
+    _access_token["token"] = token_data["access_token"]
+    _access_token["expires_at"] = time.time() + token_data["expires_in"] - ACCESS_TOKEN_EXPIRY_MARGIN
+    return _access_token["token"]
+
+
+async def _auth_headers(client: httpx.AsyncClient) -> dict:
+    return {"Authorization": f"Bearer {await get_access_token(client)}"}
+
+
+def _parse_response(response: httpx.Response, success_status: int) -> tuple:
+    """
+    Return (succeeded, body) for a PayPal API response. Error responses aren't always JSON
+    (e.g. an HTML 5xx page or an empty body), so a body that doesn't parse becomes {}.
+    """
+    try:
+        body = orjson.loads(response.content)
+    except orjson.JSONDecodeError:
+        return False, {}
+    return response.status_code == success_status, body
+
+
+async def create_paypal_payment(client: httpx.AsyncClient, payment: dict) -> tuple:
+    """
+    Create a payment the payer then approves on PayPal.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client.
+        payment (dict): The payment request (intent, payer, redirect_urls, transactions).
+
+    Returns:
+        tuple: (succeeded, body) - the created payment (with its approval link) on success,
+               PayPal's error details otherwise.
+    """
+    response = await client.post(
+        f"{PAYPAL_API_BASE_URL}/v1/payments/payment",
+        json=payment,
+        headers=await _auth_headers(client)
+    )
+    return _parse_response(response, 201)
+
+
+async def execute_payment(client: httpx.AsyncClient, payment_id: str, payer_id: str) -> tuple:
+    """
+    Execute (capture) a payment the payer approved.
+
+    Args:
+        client (httpx.AsyncClient): The shared HTTP client.
+        payment_id (str): The PayPal payment ID.
+        payer_id (str): The payer ID PayPal passed to the return URL.
+
+    Returns:
+        tuple: (succeeded, body) - the executed payment on success, PayPal's error details otherwise.
+    """
+    response = await client.post(
+        f"{PAYPAL_API_BASE_URL}/v1/payments/payment/{payment_id}/execute",
+        json={"payer_id": payer_id},
+        headers=await _auth_headers(client)
+    )
+    return _parse_response(response, 200)
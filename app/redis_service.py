@@ -0,0 +1,15 @@
+import os
+
+import redis
+import redis.asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Shared by every worker and instance, unlike module-level dicts which live in a single process
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+# Pooled asyncio client for async handlers, so Redis round trips don't block the event loop
+async_redis_client = redis.asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
@@ -1,28 +1,49 @@
 import io
-import json
 import os
+import uuid
 import zipfile
+from concurrent.futures import FIRST_EXCEPTION, wait
+from typing import List
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
-from starlette.responses import JSONResponse, StreamingResponse
+import orjson
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from starlette.responses import StreamingResponse
 
 from .auth import get_current_user
 from .events import generate_event_folder_path
-from .guests import validate_guest_by_uuid_and_phone_number
+from .guests import validate_guest_by_uuid_and_phone_number, set_job_status, PHONE_NUMBER_RE
 from ..dynamodb_service import get_event_by_id, update_event_status
-from ..s3_service import upload_file_to_s3, download_file_as_bytes, s3_client, \
-    generate_presigned_url
+from ..s3_service import upload_file_to_s3, upload_small_file_to_s3, stream_file_from_s3, s3_client, \
+    generate_presigned_urls, BUCKET_NAME, SMALL_UPLOAD_MAX_SIZE, album_upload_executor, generate_presigned_multipart_upload, \
+    complete_multipart_upload, download_file_to_temp, MULTIPART_UPLOAD_MAX_PARTS
 
-BUCKET_NAME = "photoguests-events"
+# Album ZIPs uploaded straight to S3 are staged here until their images are extracted
+ALBUM_UPLOAD_KEY = "uploads/album.zip"
+ALBUM_UPLOAD_CONTENT_TYPE = "application/zip"
+# Part URLs stay valid for a day, so a multi-GB ZIP on a slow uplink can finish uploading
+ALBUM_UPLOAD_URL_EXPIRATION = 24 * 60 * 60
 
 router = APIRouter()
 
 
+class AlbumUploadPart(BaseModel):
+    part_number: int
+    etag: str  # The ETag header S3 returned for the part's PUT
+
+
+class CompleteAlbumUpload(BaseModel):
+    upload_id: str
+    parts: List[AlbumUploadPart]
+
+
 @router.post("/{event_id}/upload-event-album")
 async def upload_event_album(event_id: str, album: UploadFile = File(...),
                              current_user: str = Depends(get_current_user)):
     """
-    Extracts images from a ZIP file, renames them sequentially, and uploads them to S3 one-by-one.
+    Extracts images from a ZIP file, renames them sequentially, and uploads them to S3 concurrently.
 
     Args:
         event_id (str): The event ID.
@@ -33,69 +54,217 @@ async def upload_event_album(event_id: str, album: UploadFile = File(...),
         dict: Success message if all images are uploaded successfully.
     """
     try:
-        event = get_event_by_id(event_id)
-        if not event:
-            raise HTTPException(status_code=404, detail="Event not found")
+        event = await _get_event_for_album_upload(event_id, current_user)
 
-        if event["email"] != current_user:
-            raise HTTPException(status_code=403, detail="You are not authorized to upload to this event")
+        # Open the ZIP straight from the uploaded (spooled) file - no second copy of the whole archive in memory
+        uploaded_count = await _process_album_zip(event, album.file)
 
-        # Block re-upload if an album is already uploaded
-        if event.get("status") == "אלבום הועלה":
-            raise HTTPException(status_code=400, detail="An album has already been uploaded for this event.")
+        return ORJSONResponse(
+            content={"message": f"Album uploaded successfully! {uploaded_count} images processed."},
+            status_code=200)
 
-        # Read ZIP file
-        zip_file = await album.read()
-        with zipfile.ZipFile(io.BytesIO(zip_file), "r") as zip_ref:
-            # Exclude unnecessary files and folders
-            ignored_files = ["__MACOSX/", ".DS_Store", "Thumbs.db", "desktop.ini"]
-            image_files = [file for file in zip_ref.namelist()
-                           if not any(file.startswith(ignore) for ignore in ignored_files)
-                           and file.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid ZIP file format.")
 
-            if not image_files:
-                raise HTTPException(status_code=400, detail="No valid images found in the ZIP file.")
+    except HTTPException:
+        raise  # Keep the original FastAPI exceptions
 
-            max_images_allowed = event.get("num_images", 10000)
-            if len(image_files) > max_images_allowed:
-                raise HTTPException(status_code=400,
-                                    detail=f"Uploaded ZIP contains {len(image_files)} images, exceeding the allowed limit of {max_images_allowed}.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing album: {str(e)}")
 
-            event_folder_path = generate_event_folder_path(event)
-            uploaded_files = []
 
-            # Sequential upload (cheapest approach)
-            for index, original_filename in enumerate(image_files, start=1):
-                file_ext = os.path.splitext(original_filename)[1]  # Get file extension (.jpg, .png, etc.)
-                new_filename = f"{index}{file_ext}"
+@router.post("/{event_id}/album-upload-url")
+async def get_album_upload_url(event_id: str, part_count: int, current_user: str = Depends(get_current_user)):
+    """
+    Start a direct-to-S3 multipart upload of the album ZIP, for albums too large to post through the API.
+    The browser PUTs the parts to the returned URLs in parallel (retrying only parts that fail),
+    then calls complete-album-upload with the upload ID and each part's ETag.
 
-                # Read image bytes
-                with zip_ref.open(original_filename) as image_file:
-                    image_data = io.BytesIO(image_file.read())  # Convert to BytesIO object for S3 upload
+    Args:
+        event_id (str): The event ID.
+        part_count (int): Number of parts the client splits the ZIP into (parts except the last must be >= 5 MB).
+        current_user (str): The authenticated user email.
 
-                s3_key = f"{event_folder_path}album/{new_filename}"
-                upload_success = upload_file_to_s3(image_data, s3_key, content_type=f"image/{file_ext.lstrip('.')}")
+    Returns:
+        dict: {"upload_id": ..., "part_urls": [...]} - part_urls[i] uploads part number i + 1.
+    """
+    if not 1 <= part_count <= MULTIPART_UPLOAD_MAX_PARTS:
+        raise HTTPException(status_code=400, detail=f"part_count must be between 1 and {MULTIPART_UPLOAD_MAX_PARTS}.")
 
-                if upload_success:
-                    uploaded_files.append(new_filename)
-                else:
-                    raise HTTPException(status_code=500, detail=f"Failed to upload {new_filename}")
+    try:
+        event = await _get_event_for_album_upload(event_id, current_user)
+        album_s3_key = f"{generate_event_folder_path(event)}{ALBUM_UPLOAD_KEY}"
 
-        # Mark event as having an uploaded album
-        update_event_status(event_id, "אלבום הועלה")
+        return await run_in_threadpool(generate_presigned_multipart_upload, album_s3_key, ALBUM_UPLOAD_CONTENT_TYPE,
+                                       part_count, ALBUM_UPLOAD_URL_EXPIRATION)
 
-        return JSONResponse(
-            content={"message": f"Album uploaded successfully! {len(uploaded_files)} images processed."},
-            status_code=200)
+    except HTTPException:
+        raise
 
-    except zipfile.BadZipFile:
-        raise HTTPException(status_code=400, detail="Invalid ZIP file format.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating album upload URLs: {str(e)}")
+
+
+@router.post("/{event_id}/complete-album-upload", status_code=202)
+async def complete_album_upload(event_id: str, upload: CompleteAlbumUpload, background_tasks: BackgroundTasks,
+                                current_user: str = Depends(get_current_user)):
+    """
+    Finish a multipart album upload started with album-upload-url, then queue a job that extracts
+    and uploads its images exactly like upload-event-album does.
+    Responds right away with the job ID; progress is available from GET /guests/jobs/{job_id}.
+
+    Args:
+        event_id (str): The event ID.
+        upload (CompleteAlbumUpload): The upload ID and the part numbers with their ETags.
+        background_tasks (BackgroundTasks): Runs the album processing job after the response.
+        current_user (str): The authenticated user email.
+
+    Returns:
+        dict: {"job_id": ...}
+    """
+    try:
+        event = await _get_event_for_album_upload(event_id, current_user)
+        album_s3_key = f"{generate_event_folder_path(event)}{ALBUM_UPLOAD_KEY}"
+
+        try:
+            # A rejected upload (bad part list, unknown or expired upload ID) is aborted by the helper
+            await run_in_threadpool(complete_multipart_upload, album_s3_key, upload.upload_id,
+                                    [(part.part_number, part.etag) for part in upload.parts])
+        except s3_client.exceptions.ClientError as e:
+            raise HTTPException(status_code=400,
+                                detail=f"Album upload could not be completed: {e.response['Error']['Code']}")
+
+        # Extracting thousands of images outlasts client and load balancer timeouts, so it runs as a job
+        job_id = uuid.uuid4().hex
+        await set_job_status(job_id, status="queued", event_id=event_id, email=current_user)
+
+        background_tasks.add_task(run_album_processing_job, job_id, event, album_s3_key)
+
+        return {"job_id": job_id}
 
     except HTTPException:
         raise  # Keep the original FastAPI exceptions
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing album: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error completing album upload: {str(e)}")
+
+
+async def run_album_processing_job(job_id: str, event: dict, album_s3_key: str):
+    """ Background job: extract and upload the images of a staged album ZIP and record the outcome. """
+    await set_job_status(job_id, status="running")
+    try:
+        # The assembled ZIP is fetched once into a temp file (ZipFile needs random access)
+        with await run_in_threadpool(download_file_to_temp, album_s3_key) as album_file:
+            uploaded_count = await _process_album_zip(event, album_file)
+        await set_job_status(job_id, status="completed", uploaded=uploaded_count,
+                             message=f"Album uploaded successfully! {uploaded_count} images processed.")
+    except zipfile.BadZipFile:
+        await set_job_status(job_id, status="failed", message="Invalid ZIP file format.")
+    except HTTPException as e:
+        await set_job_status(job_id, status="failed", message=e.detail)
+    except Exception as e:
+        print(f"Error in album processing job {job_id}: {e}")
+        await set_job_status(job_id, status="failed", message=f"Error processing album: {str(e)}")
+    finally:
+        # The staged ZIP is removed whether or not its images could be processed
+        try:
+            await run_in_threadpool(s3_client.delete_object, Bucket=BUCKET_NAME, Key=album_s3_key)
+        except Exception as e:
+            print(f"Error deleting staged album {album_s3_key}: {e}")
+
+
+async def _get_event_for_album_upload(event_id: str, current_user: str) -> dict:
+    """ Fetch the event an album is uploaded to, checking the user owns it and has no album yet. """
+    event = await run_in_threadpool(get_event_by_id, event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    if event["email"] != current_user:
+        raise HTTPException(status_code=403, detail="You are not authorized to upload to this event")
+
+    # Block re-upload if an album is already uploaded
+    if event.get("status") == "אלבום הועלה":
+        raise HTTPException(status_code=400, detail="An album has already been uploaded for this event.")
+
+    return event
+
+
+async def _process_album_zip(event: dict, zip_file) -> int:
+    """
+    Upload the images of an album ZIP to the event's album/ folder and mark the album as uploaded.
+
+    Args:
+        event (dict): The event the album belongs to.
+        zip_file: A seekable file object holding the ZIP.
+
+    Returns:
+        int: The number of images uploaded.
+    """
+    with zipfile.ZipFile(zip_file, "r") as zip_ref:
+        # Exclude unnecessary files and folders
+        ignored_files = ["__MACOSX/", ".DS_Store", "Thumbs.db", "desktop.ini"]
+        image_files = [file for file in zip_ref.namelist()
+                       if not any(file.startswith(ignore) for ignore in ignored_files)
+                       and file.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+        if not image_files:
+            raise HTTPException(status_code=400, detail="No valid images found in the ZIP file.")
+
+        max_images_allowed = event.get("num_images", 10000)
+        if len(image_files) > max_images_allowed:
+            raise HTTPException(status_code=400,
+                                detail=f"Uploaded ZIP contains {len(image_files)} images, exceeding the allowed limit of {max_images_allowed}.")
+
+        event_folder_path = generate_event_folder_path(event)
+
+        # Images are extracted and uploaded in parallel on the album upload thread pool
+        uploaded_files = await run_in_threadpool(_upload_album_images, zip_ref, image_files, event_folder_path)
+
+    # Mark event as having an uploaded album
+    await run_in_threadpool(update_event_status, event["event_id"], "אלבום הועלה")
+
+    return len(uploaded_files)
+
+
+def _upload_album_images(zip_ref: zipfile.ZipFile, image_files: list, event_folder_path: str) -> list:
+    """
+    Upload the album images of a ZIP file to S3 as 1.jpg, 2.png, ... in parallel on the album upload pool (blocking).
+    ZipFile serializes reads of the shared archive, so members can be extracted from several threads.
+
+    Returns:
+        list: The new file names, in upload order.
+    """
+    def upload_image(numbered_file):
+        index, original_filename = numbered_file
+        file_ext = os.path.splitext(original_filename)[1]  # Get file extension (.jpg, .png, etc.)
+        new_filename = f"{index}{file_ext}"
+
+        # Read image bytes
+        with zip_ref.open(original_filename) as image_file:
+            image_data = image_file.read()
+
+        s3_key = f"{event_folder_path}album/{new_filename}"
+        content_type = f"image/{file_ext.lstrip('.')}"
+        # Typical photos fit a single PUT; only oversized files go through the multipart transfer
+        if len(image_data) <= SMALL_UPLOAD_MAX_SIZE:
+            upload_small_file_to_s3(image_data, s3_key, content_type)
+        else:
+            upload_file_to_s3(io.BytesIO(image_data), s3_key, content_type)
+        return new_filename
+
+    uploads = [album_upload_executor.submit(upload_image, numbered_file)
+               for numbered_file in enumerate(image_files, start=1)]
+
+    # On the first failure the queued uploads are cancelled, and the ones already running are waited for,
+    # so no task is left reading the ZIP after the caller closed it
+    _, pending = wait(uploads, return_when=FIRST_EXCEPTION)
+    if pending:
+        for upload in pending:
+            upload.cancel()
+        wait(pending)
+
+    # Failures are raised by the upload helpers and surface here
+    return [upload.result() for upload in uploads]
 
 
 @router.get("/get-personalized-album/{event_id}/{phone_number}/{guest_uuid}", response_class=StreamingResponse)
@@ -111,8 +280,11 @@ async def get_personalized_album(event_id: str, phone_number: str, guest_uuid: s
     Returns:
         StreamingResponse: The personalized album ZIP file.
     """
+    # The phone number is part of the album's S3 key, so it is checked before any I/O
+    if not PHONE_NUMBER_RE.match(phone_number):
+        raise HTTPException(status_code=400, detail="Invalid phone number")
 
-    event = get_event_by_id(event_id)
+    event = await run_in_threadpool(get_event_by_id, event_id)
     event_folder_path = generate_event_folder_path(event)
 
     await validate_guest_by_uuid_and_phone_number(event_folder_path, guest_uuid, phone_number)
@@ -121,19 +293,21 @@ async def get_personalized_album(event_id: str, phone_number: str, guest_uuid: s
     s3_key = f"{event_folder_path}personalized-mapping/{phone_number}/{album_filename}"
 
     try:
-        s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_key)
-        file_data = download_file_as_bytes(s3_key)
+        # The blocking GET runs on the thread pool so the event loop keeps serving other requests
+        file_chunks, content_length = await run_in_threadpool(stream_file_from_s3, s3_key)
+    except s3_client.exceptions.NoSuchKey:
+        raise HTTPException(404, "Album not found.")
     except s3_client.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == "404":
-            raise HTTPException(404, "Album not found.")
         raise HTTPException(500, f"Error retrieving album: {str(e)}")
     except Exception as e:
         raise HTTPException(500, f"Unexpected error: {str(e)}")
 
+    # The zip is relayed chunk by chunk (Starlette iterates the blocking iterator in its thread pool)
     return StreamingResponse(
-        io.BytesIO(file_data),
+        file_chunks,
         media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={guest_uuid}.zip"}
+        headers={"Content-Disposition": f"attachment; filename={guest_uuid}.zip",
+                 "Content-Length": str(content_length)}
     )
 
 
@@ -150,8 +324,11 @@ async def get_personalized_album_photos(event_id: str, phone_number: str, guest_
     Returns:
         dict: A JSON response containing an array of image URLs.
     """
+    if not PHONE_NUMBER_RE.match(phone_number):
+        raise HTTPException(status_code=400, detail="Invalid phone number")
+
     try:
-        event = get_event_by_id(event_id)
+        event = await run_in_threadpool(get_event_by_id, event_id)
         if not event:
             raise HTTPException(status_code=404, detail="Event not found")
 
@@ -162,8 +339,7 @@ async def get_personalized_album_photos(event_id: str, phone_number: str, guest_
         matches_json_path = f"{event_folder_path}personalized-mapping/{phone_number}/matches.json"
 
         try:
-            response = s3_client.get_object(Bucket="photoguests-events", Key=matches_json_path)
-            matches_data = json.loads(response["Body"].read().decode("utf-8"))
+            matches_data = await run_in_threadpool(_read_matches_json, matches_json_path)
         except s3_client.exceptions.NoSuchKey:
             raise HTTPException(status_code=404, detail="No personalized album found for this guest.")
 
@@ -173,9 +349,15 @@ async def get_personalized_album_photos(event_id: str, phone_number: str, guest_
             return {"photos": []}  # No matching photos for this guest
 
         album_folder_path = f"{event_folder_path}album/"
-        photo_urls = [generate_presigned_url(f"{album_folder_path}{photo}") for photo in matching_photos]
+        photo_urls = await run_in_threadpool(generate_presigned_urls, [f"{album_folder_path}{photo}" for photo in matching_photos])
 
         return {"photos": photo_urls}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving photos: {str(e)}")
+
+
+def _read_matches_json(matches_json_path: str) -> dict:
+    """ Download and parse a guest's matches.json from S3 (blocking). """
+    response = s3_client.get_object(Bucket=BUCKET_NAME, Key=matches_json_path)
+    return orjson.loads(response["Body"].read())
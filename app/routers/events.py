@@ -1,21 +1,32 @@
+import re
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 from typing import List
 
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 
 from .auth import get_current_user
 from ..dynamodb_service import save_event, fetch_events_by_email, get_event_by_id
 # from ..keyspaces_service import save_event, fetch_events_by_email, get_event_by_id
 from ..enums.event_status import EventStatus
-from ..s3_service import create_event_folder, upload_file_to_s3, append_to_guest_list_in_s3
 
 router = APIRouter()
 
+# The event fields that make up its S3 folder path
+EVENT_FOLDER_PATH_FIELDS = frozenset(["username", "date", "name", "event_id"])
+
+# Event names and usernames become S3 key segments: any text (Hebrew included) up to 128 characters,
+# but no '/' (it would split the segment), no backslash and no control characters. Segments made only of
+# dots ('.', '..') are refused too: URL clients normalize them away in the presigned URL paths.
+S3_KEY_SEGMENT_RE = re.compile(r"\A(?!\.+\Z)[^/\\\x00-\x1f\x7f]{1,128}\Z")
+
 
 # Request Model for Event Creation
 class EventRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     name: str
     date: str  # Format: YYYY-MM-DD
     phone: str
@@ -28,6 +39,8 @@ class EventRequest(BaseModel):
 
 # Smaller Event Model (for listing events)
 class EventSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     event_id: str
     name: str
     date: str
@@ -35,6 +48,13 @@ class EventSummary(BaseModel):
     email: str
 
 
+EVENT_SUMMARY_FIELDS = ("event_id", "name", "date", "status", "email")
+
+# Built once - validates a whole list of summaries in a single pydantic-core pass.
+# FastAPI's response_model check then accepts the EventSummary instances as they are.
+event_summaries_adapter = TypeAdapter(List[EventSummary])
+
+
 @router.get("/", response_model=List[EventSummary])
 def get_user_events(current_user: str = Depends(get_current_user)):
     """
@@ -43,16 +63,8 @@ def get_user_events(current_user: str = Depends(get_current_user)):
     try:
         events = fetch_events_by_email(current_user)
 
-        return [
-            EventSummary(
-                event_id=event["event_id"],
-                name=event["name"],
-                date=event["date"],
-                status=event["status"],
-                email=event["email"],
-            )
-            for event in events
-        ]
+        return event_summaries_adapter.validate_python(
+            [{key: event[key] for key in EVENT_SUMMARY_FIELDS} for event in events])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching events: {str(e)}")
 
@@ -71,15 +83,23 @@ def create_event(request: EventRequest, current_user: str = Depends(get_current_
     try:
         event_id = str(uuid.uuid4())
         try:
-            event_date = datetime.strptime(request.date, "%Y-%m-%d").date()
+            # date.fromisoformat is implemented in C; the length check pins it to YYYY-MM-DD
+            if len(request.date) != 10:
+                raise ValueError(request.date)
+            event_date = date.fromisoformat(request.date)
         except ValueError:
             raise HTTPException(400, "Invalid date format. Use YYYY-MM-DD.")
 
-        create_event_folder(request.username, str(event_date), request.name, event_id)
+        # Rejected up front, before anything is stored under a key built from them
+        if not S3_KEY_SEGMENT_RE.match(request.name) or not S3_KEY_SEGMENT_RE.match(request.username):
+            raise HTTPException(400, "Event name and username must be 1-128 characters without '/' or '\\', "
+                                     "and not only dots.")
+
+        # No S3 setup is needed: the event's prefix comes into existence with its first upload
 
         event_item = {
             "event_id": event_id,
-            "created_at": datetime.utcnow().isoformat(),
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
             "name": request.name,
             "date": str(event_date),
             "username": request.username,
@@ -97,6 +117,9 @@ def create_event(request: EventRequest, current_user: str = Depends(get_current_
             "message": "Event created successfully.",
         }
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating event: {str(e)}")
 
@@ -107,7 +130,7 @@ async def get_event_details(event_id: str, current_user: str = Depends(get_curre
     Fetch the details of a specific event by event_id and return only a summarized version.
     """
     try:
-        event = get_event_by_id(event_id)
+        event = await run_in_threadpool(get_event_by_id, event_id)
         if not event:
             raise HTTPException(404, "Event not found")
 
@@ -142,7 +165,7 @@ def generate_event_folder_path(event: dict) -> str:
     Returns:
         str: The folder path for the event.
     """
-    if not all(key in event for key in ["username", "date", "name", "event_id"]):
+    if not event.keys() >= EVENT_FOLDER_PATH_FIELDS:
         raise ValueError("Event details are incomplete. 'username', 'date', 'name', and 'event_id' are required.")
 
     return f"{event['username']}/{event['date']}/{event['name']}/{event['event_id']}/"
@@ -1,138 +1,335 @@
+import asyncio
+import hmac
 import os
+import re
 import uuid
 
-import boto3
-from fastapi import APIRouter, HTTPException, Header, Form, UploadFile, File
-from twilio.rest import Client
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
+from fastapi import APIRouter, HTTPException, Header, Form, Depends, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 
+from .auth import get_current_user
 from .events import generate_event_folder_path
+from ..http_client import get_http
+from ..redis_service import async_redis_client
 from ..dynamodb_service import get_event_by_id
 # from ..keyspaces_service import get_event_by_id
-from ..s3_service import get_guest_list_from_s3, upload_file_to_s3, append_to_guest_list_in_s3
-
-S3_BUCKET_NAME = "photoguests-events"
-s3_client = boto3.client("s3")
+from ..s3_service import get_cached_guest_list, invalidate_guest_list_cache, save_guest_submission_to_s3, \
+    generate_presigned_upload_post, get_guest_submission_by_phone, get_submission_guest_uuid, object_exists, \
+    guest_submission_exists, BUCKET_NAME
 
 WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 
+# Token guarding the APIs that trigger paid work (SMS blasts)
+REQUIRED_TOKEN = os.getenv("TOKEN_FOR_EXPENSIVE_REQUESTS", "")
+
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "your_account_sid")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "your_auth_token")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER", "+1234567890")
 
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+TWILIO_MESSAGES_URL = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+
+# Max SMS requests in flight per blast, and Twilio's messages-per-second cap for the account
+SMS_CONCURRENCY = 20
+sms_rate_limiter = AsyncLimiter(80, 1)
+
+BUCKET_URL = f"https://{BUCKET_NAME}.s3.amazonaws.com/"
+
+GUEST_PHOTO_CONTENT_TYPE = "image/jpeg"
+GUEST_PHOTO_MAX_SIZE = 25 * 1024 * 1024
 
-BUCKET_NAME = "photoguests-events"
+# Issued uploads, bound to the event and phone they were issued for until their POST policy expires
+GUEST_UPLOAD_KEY_PREFIX = "gup:"
+GUEST_UPLOAD_EXPIRATION = 3600
+
+# Phone numbers are part of guest S3 keys: digits with an optional leading '+' and dashes only
+PHONE_NUMBER_RE = re.compile(r"\A\+?[0-9][0-9-]{5,19}\Z")
+
+SMS_MESSAGE_TAIL = "\n Enjoy your memories! 📸"
+
+# Background job records in Redis, kept for a day after their last update
+JOB_KEY_PREFIX = "job:"
+JOB_EXPIRATION = 24 * 60 * 60
 
 router = APIRouter()
 
 
+def _random_guest_uuids(batch_size: int = 256):
+    """
+    Yield random (version 4) UUIDs as 32-character hex strings, reading entropy from
+    os.urandom once per batch instead of once per guest submission.
+
+    The guest UUID doubles as the access token for the personalized album link,
+    so it must stay unpredictable - a time-based counter is not an option here.
+    Upload IDs are drawn from the same stream.
+    """
+    while True:
+        entropy = os.urandom(16 * batch_size)
+        for offset in range(0, len(entropy), 16):
+            yield uuid.UUID(bytes=entropy[offset:offset + 16], version=4).hex
+
+
+# Only consumed from the event loop thread (async handlers), so no lock is needed
+_guest_uuids = _random_guest_uuids()
+
+
+@router.get("/{event_id}/guest-submission-url")
+async def get_guest_submission_url(event_id: str, phone: str):
+    """
+    Issue a pre-signed POST the guest's browser uses to upload their photo straight to S3:
+    a multipart form POST to upload_url with the returned fields, followed by the file.
+    The returned upload_id must be sent back to submit-guest once the upload finished; it is
+    bound to this event and phone on the server and expires with the POST policy.
+    A phone that already has a submission is refused here, before anything is uploaded.
+    """
+    if not PHONE_NUMBER_RE.match(phone):
+        raise HTTPException(status_code=400, detail="Invalid phone number")
+
+    try:
+        event = await run_in_threadpool(get_event_by_id, event_id)
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+
+        event_folder_path = generate_event_folder_path(event)
+
+        if await run_in_threadpool(guest_submission_exists, event_folder_path, phone):
+            raise HTTPException(status_code=409, detail="A guest with this phone number was already submitted")
+
+        # The upload ID only names the photo - the album UUID is created at submission and sent by SMS only
+        upload_id = next(_guest_uuids)
+
+        guest_photo_s3_key = f"{event_folder_path}guest-submissions/{phone}_{upload_id}.jpg"
+
+        # The botocore fallback (no static credentials) can block on credential resolution, e.g. IMDS
+        upload = await run_in_threadpool(generate_presigned_upload_post, guest_photo_s3_key, GUEST_PHOTO_CONTENT_TYPE,
+                                         GUEST_PHOTO_MAX_SIZE, GUEST_UPLOAD_EXPIRATION)
+
+        await async_redis_client.set(f"{GUEST_UPLOAD_KEY_PREFIX}{upload_id}",
+                                     orjson.dumps({"event_id": event_id, "phone": phone}),
+                                     ex=GUEST_UPLOAD_EXPIRATION)
+
+        return {"upload_url": upload["url"], "fields": upload["fields"], "upload_id": upload_id}
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating submission URL: {str(e)}")
+
+
 @router.post("/{event_id}/submit-guest")
 async def submit_guest(
         event_id: str,
         name: str = Form(...),
         phone: str = Form(...),
-        photo: UploadFile = File(...)
+        upload_id: str = Form(...)
 ):
-    """ Handle the submission of a guest's details (name, phone, photo) and upload it to S3. """
+    """
+    Record a guest's details (name, phone) after their photo was uploaded directly to S3
+    through the URL issued by get-guest-submission-url.
+
+    The upload must have been issued for this event and phone, and its photo must exist.
+    A phone can be submitted once per event; the guest's album link is only ever sent by SMS.
+    """
     try:
-        event = get_event_by_id(event_id)
+        if not PHONE_NUMBER_RE.match(phone):
+            raise HTTPException(status_code=400, detail="Invalid phone number")
+
+        upload_key = f"{GUEST_UPLOAD_KEY_PREFIX}{upload_id}"
+        issued_upload = await async_redis_client.get(upload_key)
+        if issued_upload is None or orjson.loads(issued_upload) != {"event_id": event_id, "phone": phone}:
+            raise HTTPException(status_code=400, detail="Invalid or expired upload")
+
+        event = await run_in_threadpool(get_event_by_id, event_id)
         if not event:
             raise HTTPException(status_code=404, detail="Event not found")
 
         event_folder_path = generate_event_folder_path(event)
 
-        guest_uuid = uuid.uuid4()
-
-        guest_photo_s3_key = f"{event_folder_path}guest-submissions/{phone}_{guest_uuid}.jpg"
-
-        upload_success = upload_file_to_s3(photo.file, guest_photo_s3_key, photo.content_type)
+        submission_name = f"{phone}_{upload_id}"
+        photo_s3_key = f"{event_folder_path}guest-submissions/{submission_name}.jpg"
 
-        if not upload_success:
-            raise HTTPException(status_code=500, detail="Failed to upload the photo")
+        if not await run_in_threadpool(object_exists, photo_s3_key):
+            raise HTTPException(status_code=400, detail="Photo was not uploaded")
 
         guest_submission = {
             "name": name,
             "phone": phone,
-            "photo_url": f"https://{BUCKET_NAME}.s3.amazonaws.com/{guest_photo_s3_key}"}
+            "guest_uuid": next(_guest_uuids),
+            "photo_url": f"{BUCKET_URL}{photo_s3_key}"}
 
-        guest_list_submissions_s3_key = f"{event_folder_path}guest-submissions/guest_list.json"
+        saved = await run_in_threadpool(save_guest_submission_to_s3, event_folder_path, submission_name,
+                                        guest_submission)
+        if not saved:
+            raise HTTPException(status_code=409, detail="A guest with this phone number was already submitted")
 
-        append_to_guest_list_in_s3(guest_list_submissions_s3_key, guest_submission)
+        await async_redis_client.delete(upload_key)
+        invalidate_guest_list_cache(event_folder_path)
 
         return {"message": "Guest submitted successfully!"}
 
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error submitting guest: {str(e)}")
 
 
 # SMS VERSION
-@router.post("/send-personalized-albums/")
-def send_personalized_albums(
+@router.post("/send-personalized-albums/", status_code=202)
+async def send_personalized_albums(
         event_id: str,
-        authorization: str = Header(None)
+        background_tasks: BackgroundTasks,
+        authorization: str = Header(None),
+        http_client: httpx.AsyncClient = Depends(get_http)
 ):  # Sent manually
     """
-    Retrieve guest phone numbers and send them their personalized album links via SMS.
+    Queue a job that sends every guest their personalized album link via SMS.
+    Responds right away with the job ID; progress is available from GET /guests/jobs/{job_id}.
     Requires a specific authorization token to run this API.
     """
 
     # Validate Authorization Token
-    REQUIRED_TOKEN = os.getenv("TOKEN_FOR_EXPENSIVE_REQUESTS")
-    if authorization != REQUIRED_TOKEN:
+    if not is_authorized_for_expensive_requests(authorization):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
     try:
         # Fetch event details directly from the database instead of calling an API
-        event = get_event_by_id(event_id)
+        event = await run_in_threadpool(get_event_by_id, event_id)
         if not event:
             raise HTTPException(status_code=404, detail="Event not found.")
 
         event_path = generate_event_folder_path(event)
 
-        guests = get_guest_list_from_s3(event_path)
+        guests, _ = await run_in_threadpool(get_cached_guest_list, event_path)
 
         if not guests:
             raise HTTPException(status_code=404, detail="No guests found for this event.")
 
-        success_count = 0
+        job_id = uuid.uuid4().hex
+        await set_job_status(job_id, status="queued", event_id=event_id, total=len(guests))
 
-        for guest in guests:
-            phone_number = guest.get("phone")
+        background_tasks.add_task(run_album_sms_job, job_id, http_client, event, guests)
 
-            if not phone_number:
-                continue
+        return {"job_id": job_id}
 
-            name = guest.get("name", "Guest")
+    except HTTPException:
+        raise
 
-            guest_uuid = guest.get("photo_url").split("/")[-1].rsplit(".", 1)[0]
+    except Exception as e:
+        print(f"Error processing request: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while processing the request.")
 
-            personal_album_link = f"http://localhost:8000/albums/get-personalized-album/{event_id}/{phone_number}/{guest_uuid}"  # TODO: use env variable for the IP address
 
-            if send_sms_message(event["name"], phone_number, name, personal_album_link):
-                success_count += 1
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, authorization: str = Header(None)):
+    """
+    Return the progress of a background job, e.g. a personalized album SMS blast or an album upload.
+    Requires the same authorization token as the API that started the job; jobs started by a user
+    (they carry an 'email') can also be read with that user's bearer token.
+    """
+    job = await async_redis_client.hgetall(f"{JOB_KEY_PREFIX}{job_id}")
 
-        return {"message": f"Successfully sent {success_count}/{len(guests)} SMS messages."}
+    if not is_authorized_for_expensive_requests(authorization) and not await _is_job_owner(job, authorization):
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
-    except Exception as e:
-        print(f"Error processing request: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while processing the request.")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    return job
+
+
+async def _is_job_owner(job: dict, authorization: str) -> bool:
+    """ Check whether the Authorization header is the bearer token of the user who started the job. """
+    if not job.get("email") or not (authorization or "").startswith("Bearer "):
+        return False
+    try:
+        # Token validation calls Google with a blocking HTTP client
+        return await run_in_threadpool(get_current_user, authorization[len("Bearer "):]) == job["email"]
+    except HTTPException:
+        return False
 
 
-def send_sms_message(event_name: str, phone_number: str, name: str, personal_album_endpoint: str) -> bool:
+def is_authorized_for_expensive_requests(authorization: str) -> bool:
     """
-    Send a personalized SMS with the guest's name and album link using Twilio.
+    Check the Authorization header against REQUIRED_TOKEN in constant time.
+    Always fails when no token is configured.
     """
-    message_body = f"Hi {name}! 🎉 Your {event_name} album is ready. Link to download as zip file: {personal_album_endpoint}\n Enjoy your memories! 📸"
+    return bool(REQUIRED_TOKEN) and hmac.compare_digest((authorization or "").encode(), REQUIRED_TOKEN.encode())
 
+
+async def set_job_status(job_id: str, **fields):
+    """ Record the status of a background job in Redis, where any worker can read it. """
+    job_key = f"{JOB_KEY_PREFIX}{job_id}"
+    async with async_redis_client.pipeline() as pipe:
+        pipe.hset(job_key, mapping=fields)
+        pipe.expire(job_key, JOB_EXPIRATION)
+        await pipe.execute()
+
+
+async def run_album_sms_job(job_id: str, http_client: httpx.AsyncClient, event: dict, guests: list):
+    """ Background job: send the album SMS to every guest and record the outcome. """
+    await set_job_status(job_id, status="running")
     try:
-        message = twilio_client.messages.create(
-            body=message_body,
-            from_=TWILIO_PHONE_NUMBER,
-            to=phone_number
-        )
+        success_count = await send_album_sms_to_guests(http_client, event, guests)
+        await set_job_status(job_id, status="completed", sent=success_count,
+                             message=f"Successfully sent {success_count}/{len(guests)} SMS messages.")
+    except Exception as e:
+        print(f"Error in album SMS job {job_id}: {e}")
+        await set_job_status(job_id, status="failed", message=str(e))
+
+
+async def send_album_sms_to_guests(http_client: httpx.AsyncClient, event: dict, guests: list) -> int:
+    """
+    Send each guest their personalized album link via SMS, concurrently.
+
+    Returns:
+        int: The number of messages sent successfully.
+    """
+    # Drop guests that can't be messaged before doing any per-guest work
+    valid_guests = [
+        (guest["phone"], guest.get("name", "Guest"), guest["guest_uuid"])
+        for guest in guests
+        if guest.get("phone") and guest["guest_uuid"]
+    ]
 
-        print(f"✅ SMS sent to {name} ({phone_number}) | SID: {message.sid}")
+    # Everything that is constant for the event is formatted once, outside the loop
+    album_link_prefix = f"http://localhost:8000/albums/get-personalized-album/{event['event_id']}/"  # TODO: use env variable for the IP address
+    message_middle = f"! 🎉 Your {event['name']} album is ready. Link to download as zip file: "
+
+    semaphore = asyncio.Semaphore(SMS_CONCURRENCY)
+    sends = []
+
+    for phone_number, name, guest_uuid in valid_guests:
+        personal_album_link = album_link_prefix + phone_number + "/" + guest_uuid
+        message_body = "Hi " + name + message_middle + personal_album_link + SMS_MESSAGE_TAIL
+
+        sends.append(send_sms_message(http_client, phone_number, name, message_body, semaphore))
+
+    results = await asyncio.gather(*sends, return_exceptions=True)
+    return sum(result is True for result in results)
+
+
+async def send_sms_message(http_client: httpx.AsyncClient, phone_number: str, name: str, message_body: str,
+                           semaphore: asyncio.Semaphore) -> bool:
+    """
+    Send a personalized SMS with the guest's name and album link through Twilio's REST API.
+    The message body is pre-built by the caller from the per-event template.
+    Concurrency is bounded by the caller's semaphore and the account-wide rate limiter.
+    """
+    try:
+        async with semaphore, sms_rate_limiter:
+            response = await http_client.post(
+                TWILIO_MESSAGES_URL,
+                data={"Body": message_body, "From": TWILIO_PHONE_NUMBER, "To": phone_number},
+                auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+            )
+        response.raise_for_status()
+
+        print(f"✅ SMS sent to {name} ({phone_number}) | SID: {response.json()['sid']}")
         return True
 
     except Exception as e:
@@ -174,16 +371,17 @@ def send_sms_message(event_name: str, phone_number: str, name: str, personal_alb
 
 
 async def validate_guest_by_uuid_and_phone_number(event_folder_path, guest_uuid, phone_number):
-    guests = get_guest_list_from_s3(event_folder_path)
+    # Fast path: the submission the phone is registered with, stored under their phone number.
+    # The S3 reads are blocking boto3 calls, so they run on the thread pool instead of the event loop.
+    guest = await run_in_threadpool(get_guest_submission_by_phone, event_folder_path, phone_number)
+    if guest and get_submission_guest_uuid(guest) == guest_uuid:
+        return
+
+    # Legacy submissions - from when each new submission overwrote the by-phone entry, or from before
+    # by-phone entries existed - are only in the full guest list
+    guests, guest_index = await run_in_threadpool(get_cached_guest_list, event_folder_path)
     if not guests:
         raise HTTPException(status_code=404, detail="No guests found for this event.")
-    matching_guest = next(
-        (
-            g for g in guests
-            if g.get("phone") == phone_number
-               and os.path.splitext(g.get("photo_url", "").split("/")[-1].split("_")[-1])[0] == guest_uuid
-        ),
-        None
-    )
+    matching_guest = guest_index.get((phone_number, guest_uuid))
     if not matching_guest:
         raise HTTPException(status_code=403, detail="Guest not authorized or not found.")
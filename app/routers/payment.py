@@ -1,18 +1,28 @@
+import bisect
+import functools
+import logging
 import os
-import time
 import uuid
+from datetime import date
 
 import httpx
-import paypalrestsdk
+import orjson
 from dotenv import load_dotenv
 from fastapi import HTTPException, Depends, APIRouter, Request
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError, field_validator
 from starlette.responses import RedirectResponse
 
 from .auth import get_current_user
+from .events import EventRequest, create_event, S3_KEY_SEGMENT_RE
+from ..http_client import get_http
+from ..paypal_service import create_paypal_payment, execute_payment
+from ..redis_service import async_redis_client
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 ENV = os.getenv("ENV").lower()
 
 FRONTEND_DOMAIN = (
@@ -27,19 +37,21 @@ BACKEND_DOMAIN = (
     else os.getenv("LOCAL_BACKEND")  # Use localhost for development
 )
 
+# Production is served over TLS; local development runs on plain HTTP
+URL_SCHEME = "https" if ENV == "production" else "http"
+
+# URLs handed to PayPal and the post-payment redirect, formatted once at startup
+RETURN_URL = f"{URL_SCHEME}://{BACKEND_DOMAIN}/payment/success"
+CANCEL_URL = f"{URL_SCHEME}://{BACKEND_DOMAIN}/payment/cancel"
+SUCCESS_REDIRECT_URL = f"{URL_SCHEME}://{FRONTEND_DOMAIN}/events"
+
 router = APIRouter()
 
-# In-memory storage for temporary tokens with expiration
-token_storage = {}
+# Pending checkouts (event data + user token) are kept in Redis under this prefix and expire on their own
+PAYPAL_TOKEN_KEY_PREFIX = "pp:"
 # Token expiration time in seconds (30 minutes)
 TOKEN_EXPIRATION = 30 * 60
 
-paypalrestsdk.configure({
-    "mode": "live",
-    "client_id": os.getenv("PAYPAL_CLIENT_ID"),
-    "client_secret": os.getenv("PAYPAL_CLIENT_SECRET")
-})
-
 tiered_pricing = [
     (100, 1000, 120), (100, 2500, 240), (100, 5000, 440), (100, 10000, 840),
     (250, 1000, 180), (250, 2500, 300), (250, 5000, 500), (250, 10000, 900),
@@ -48,11 +60,41 @@ tiered_pricing = [
 ]
 
 
+# Exact (guests, images) tier choices - what the UI submits - map straight to their price
+PRICE_MAP = {(guests, images): price for guests, images, price in tiered_pricing}
+
+# tiered_pricing grouped by guest cap: sorted guest caps, and per cap the sorted image caps with their prices
+pricing_guest_caps = sorted({guests for guests, _, _ in tiered_pricing})
+pricing_image_tiers = {
+    guest_cap: tuple(zip(*sorted((images, price) for guests, images, price in tiered_pricing if guests == guest_cap)))
+    for guest_cap in pricing_guest_caps
+}
+
+
 def calculate_price(num_guests: int, num_images: int) -> int:
-    for guests, images, price in tiered_pricing:
-        if num_guests <= guests and num_images <= images:
-            return price
-    raise Exception(f"No pricing tier found for {num_guests} guests and {num_images} images.")
+    """
+    Price of the cheapest tier covering both counts.
+    Exact tier choices are a single dict lookup; other counts fall back to a search over the tiers.
+    """
+    price = PRICE_MAP.get((num_guests, num_images))
+    if price is None:
+        price = _calculate_covering_tier_price(num_guests, num_images)
+    return price
+
+
+@functools.lru_cache(maxsize=256)
+def _calculate_covering_tier_price(num_guests: int, num_images: int) -> int:
+    """
+    Price of the cheapest tier covering both counts, found by binary search over the tier caps.
+    Results are memoized - requests keep asking for the same few combinations.
+    """
+    for guest_cap in pricing_guest_caps[bisect.bisect_left(pricing_guest_caps, num_guests):]:
+        image_caps, prices = pricing_image_tiers[guest_cap]
+        image_index = bisect.bisect_left(image_caps, num_images)
+        if image_index < len(image_caps):
+            return prices[image_index]
+    raise HTTPException(status_code=400,
+                        detail=f"No pricing tier found for {num_guests} guests and {num_images} images.")
 
 
 class EventData(BaseModel):
@@ -66,15 +108,23 @@ class EventData(BaseModel):
     price: int
     token: str = None
 
+    # The event is only created after the buyer was charged, so everything create_event would reject
+    # is rejected here, before the checkout is stored or a payment is created
 
-def clean_expired_tokens():
-    """Remove expired tokens from storage"""
-    current_time = time.time()
-    expired_keys = [key for key, value in token_storage.items()
-                    if value["expires_at"] < current_time]
+    @field_validator("name", "username")
+    @classmethod
+    def validate_s3_key_segment(cls, value: str) -> str:
+        if not S3_KEY_SEGMENT_RE.match(value):
+            raise ValueError("must be 1-128 characters without '/' or '\\', and not only dots")
+        return value
 
-    for key in expired_keys:
-        del token_storage[key]
+    @field_validator("date")
+    @classmethod
+    def validate_date(cls, value: str) -> str:
+        if len(value) != 10:
+            raise ValueError("must be in YYYY-MM-DD format")
+        date.fromisoformat(value)  # Raises ValueError for invalid dates
+        return value
 
 
 @router.post("/calculate-price")
@@ -84,54 +134,48 @@ async def get_price(num_guests: int, num_images: int):
 
 
 @router.post("/create-payment")
-async def create_payment(event: EventData, user_email: str = Depends(get_current_user)):
+async def create_payment(event: EventData, user_email: str = Depends(get_current_user),
+                         http_client: httpx.AsyncClient = Depends(get_http)):
     """Creates a PayPal payment and returns approval URL with authentication"""
     calculated_price = calculate_price(event.num_guests, event.num_images)
     if calculated_price != event.price:
         raise HTTPException(status_code=400, detail="Price mismatch detected.")
 
-    # Clean expired tokens first
-    clean_expired_tokens()
-
     if event.email != user_email:
         raise HTTPException(status_code=403, detail="Unauthorized to create this event.")
 
-    reference_id = str(uuid.uuid4())  # Generated a unique reference ID (can't pass token in "custom" - too long
+    reference_id = uuid.uuid4().hex  # Generated a unique reference ID (can't pass token in "custom" - too long
 
-    # Store the token with the reference ID and expiration
-    token_storage[reference_id] = {
-        "token": event.token,
-        "expires_at": time.time() + TOKEN_EXPIRATION
-    }
+    # Store the event data and token under the reference ID - only the ID travels through PayPal.
+    # Redis drops the entry once TOKEN_EXPIRATION passes.
+    await async_redis_client.set(f"{PAYPAL_TOKEN_KEY_PREFIX}{reference_id}", orjson.dumps(event.model_dump()),
+                                 ex=TOKEN_EXPIRATION)
 
-    payment = paypalrestsdk.Payment({
+    created, payment = await create_paypal_payment(http_client, {
         "intent": "sale",
         "payer": {"payment_method": "paypal"},
         "redirect_urls": {
-            "return_url": f"http://{BACKEND_DOMAIN}/payment/success",
-            "cancel_url": f"http://{BACKEND_DOMAIN}/payment/cancel"
+            "return_url": RETURN_URL,
+            "cancel_url": CANCEL_URL
         },
         "transactions": [{
             "amount": {"total": str(calculated_price), "currency": "ILS"},
             "description": f"Payment for event {event.name}",
-            "custom": f"{event.name}|{event.date}|{event.phone}|{event.username}|{event.email}|{event.num_guests}|{event.num_images}|{event.price}|{reference_id}",
+            "custom": reference_id,
         }]
     })
 
-    if payment.create():
-        for link in payment.links:
-            if link.rel == "approval_url":
-                return {"approval_url": link.href}
+    if created:
+        for link in payment.get("links", []):
+            if link["rel"] == "approval_url":
+                return {"approval_url": link["href"]}
     else:
-        raise HTTPException(status_code=400, detail=str(payment.error))
+        raise HTTPException(status_code=400, detail=str(payment))
 
 
 @router.get("/success")
-async def payment_success(request: Request):
+async def payment_success(request: Request, http_client: httpx.AsyncClient = Depends(get_http)):
     """Handles successful PayPal payments and then creates the event"""
-    # First, clean expired tokens
-    clean_expired_tokens()
-
     payer_id = request.query_params.get("PayerID")
     payment_id = request.query_params.get("paymentId")
 
@@ -139,77 +183,61 @@ async def payment_success(request: Request):
         raise HTTPException(status_code=400, detail="Invalid PayPal response")
 
     try:
-        # Fetch PayPal payment details
-        payment = paypalrestsdk.Payment.find(payment_id)
-        if not payment:
-            raise HTTPException(status_code=400, detail="Payment not found")
-
-        # Execute the payment
-        if not payment.execute({"payer_id": payer_id}):
-            raise HTTPException(status_code=400, detail=f"Payment execution failed: {payment.error}")
+        # Execute the payment - the response carries the full payment details, so no separate lookup is needed.
+        # Unknown payment IDs are rejected by PayPal here as well.
+        executed, payment = await execute_payment(http_client, payment_id, payer_id)
+        if not executed:
+            raise HTTPException(status_code=400, detail=f"Payment execution failed: {payment}")
 
         # Check if transactions exist
-        if not payment.transactions or len(payment.transactions) == 0:
-            print("⚠️ DEBUG: No transactions found in payment:", payment.to_dict())
+        if not payment.get("transactions"):
+            logger.debug("No transactions found in payment: %s", payment)
             raise HTTPException(status_code=400, detail="No transactions found in payment")
 
         # Get transaction details
-        transaction = payment.transactions[0]
-        transaction_dict = transaction.to_dict()
+        transaction_dict = payment["transactions"][0]
 
-        # Attempt to get metadata from dictionary
-        event_metadata = transaction_dict.get("custom")
+        # The reference ID is normally a top-level field of the transaction
+        reference_id = transaction_dict.get("custom")
 
         # Fallback to related_resources if needed
-        if not event_metadata and "related_resources" in transaction_dict:
+        if not reference_id and "related_resources" in transaction_dict:
             try:
-                event_metadata = transaction_dict["related_resources"][0]["sale"]["custom"]
+                reference_id = transaction_dict["related_resources"][0]["sale"]["custom"]
             except (IndexError, KeyError, TypeError):
                 pass
 
-        if not event_metadata:
-            print("⚠️ DEBUG: Missing event metadata. Full payment data:", payment.to_dict())
+        if not reference_id:
+            logger.debug("Missing event metadata. Full payment data: %s", payment)
             raise HTTPException(status_code=400, detail="Missing event metadata")
 
-        try:
-            name, date, phone, username, email, num_guests, num_images, price, reference_id = event_metadata.split("|")
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid event metadata format")
+        # Fetch and delete the pending checkout in one step so a reference ID can only be used once
+        checkout = await async_redis_client.getdel(f"{PAYPAL_TOKEN_KEY_PREFIX}{reference_id}")
 
-        if reference_id not in token_storage:
+        if checkout is None:
             raise HTTPException(status_code=400, detail=f"Invalid or expired session. Reference ID: {reference_id}")
 
-        token = token_storage[reference_id]["token"]
+        event_data = orjson.loads(checkout)
+        token = event_data.get("token") or ""
 
-        # Clean up the token storage after successful retrieval
-        del token_storage[reference_id]
-
-        event_data = {"name": name, "date": date, "phone": phone, "username": username, "email": email,
-                      "num_guests": num_guests, "num_images": num_images, "price": price}
-
-        # Call POST /events/ API
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"http://{BACKEND_DOMAIN}/events/",
-                json=event_data,
-                headers={"Authorization": f"Bearer {token}"},
-            )
+        try:
+            event_request = EventRequest.model_validate(event_data)
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid event metadata: {str(e)}")
 
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=f"Failed to create event: {response.text}")
+        # Create the event in-process, authenticating the stored token the same way the /events/ route does.
+        # Both steps block on network I/O, so they run in the threadpool like sync routes do.
+        current_user = await run_in_threadpool(get_current_user, token)
+        await run_in_threadpool(create_event, event_request, current_user)
 
         # Redirect to frontend
-        return RedirectResponse(
-            url=f"http://{FRONTEND_DOMAIN}/events"
-        )
+        return RedirectResponse(url=SUCCESS_REDIRECT_URL)
 
-    except paypalrestsdk.ResourceNotFound as e:
-        raise HTTPException(status_code=404, detail=f"Payment not found: {str(e)}")
+    except HTTPException:
+        raise  # Keep the original FastAPI exceptions
     except KeyError as e:
-        print(f"ERROR: Key error - {e}")
+        logger.error("Key error in payment_success: %s", e)
         raise HTTPException(status_code=400, detail=f"Missing required data: {str(e)}")
     except Exception as e:
-        print(f"ERROR: Unexpected issue in payment_success: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Unexpected issue in payment_success")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -1,79 +1,299 @@
-import json
-import os
-
-import boto3
-from botocore.config import Config
-from botocore.exceptions import NoCredentialsError
-from dotenv import load_dotenv
-
-load_dotenv()
-
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
-    region_name=os.getenv("AWS_REGION"),
-    config=Config(signature_version="s3v4")
-)
+import functools
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError, NoCredentialsError
+from cachetools import TTLCache
+from redis import RedisError
+
+from .aws_clients import s3_client, s3_upload_client, S3_TRANSFER_ACCELERATION
+from .redis_service import redis_client
+from .s3_signer import presign_get_url, presign_post, PRESIGNER_ENABLED
 
 BUCKET_NAME = "photoguests-events"
 
+# SSE-S3 encryption at rest for uploaded objects - unlike aws:kms it needs no KMS call per PUT
+SERVER_SIDE_ENCRYPTION = "AES256"
+
+PRESIGNED_URL_EXPIRATION = 3600  # URLs expire in 1 hour
+# In-process signatures are reused for at most 5 minutes
+PRESIGNED_URL_SIGNING_WINDOW = 5 * 60
+# A URL can already be a signing window old when it is cached, so the Redis TTL is shortened by that much:
+# cached URLs are only handed out during the first half of their lifetime, leaving clients at least 30 minutes
+PRESIGNED_URL_CACHE_TTL = PRESIGNED_URL_EXPIRATION // 2 - PRESIGNED_URL_SIGNING_WINDOW
+PRESIGNED_URL_CACHE_KEY_PREFIX = "psu:"
+
+# S3's limit on the number of parts of a multipart upload
+MULTIPART_UPLOAD_MAX_PARTS = 10000
 
-def create_event_folder(username, event_date, event_name, event_id):
+# Shared pool for fanning out independent S3 requests (boto3 clients are thread-safe)
+s3_executor = ThreadPoolExecutor(max_workers=16)
+
+# Album uploads queue up to thousands of images at once, so they get their own pool
+# instead of making guest submissions, guest-list reads and presigns wait behind them
+album_upload_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="album-upload")
+
+# Legacy guest photo URLs end in '.../{phone}_{guest_uuid}.jpg' - captures the guest UUID.
+# Newer submissions store their guest_uuid explicitly, since their photo key is named after the upload ID.
+PHOTO_URL_GUEST_UUID_RE = re.compile(r".*/(?:[^_/]+_)?([^/]+?)\.[^./]+$")
+
+# Guest lists per event folder path, kept briefly to spare repeated S3 reads on bursts
+guest_list_cache = TTLCache(maxsize=1024, ttl=60)
+guest_list_cache_lock = threading.Lock()
+
+# Files up to 16 MB go up in a single PUT (see upload_small_file_to_s3); larger files
+# are split into 16 MB parts that are uploaded in parallel
+SMALL_UPLOAD_MAX_SIZE = 16 * 1024 * 1024
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=SMALL_UPLOAD_MAX_SIZE,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# Large server-side transfers (the staged album ZIP) go through the AWS CRT transfer client (boto3[crt]):
+# it splits the object into parallel ranged requests over its own connection pool, sized for throughput
+LARGE_TRANSFER_CONFIG = TransferConfig(
+    preferred_transfer_client="crt",
+    multipart_chunksize=16 * 1024 * 1024
+)
+
+
+def generate_presigned_url(s3_key):
     """
-    Create the S3 folder structure under the specified bucket.
-    Creates subfolders for album, guest submissions, and personalized albums.
+    Generate a pre-signed URL for accessing an S3 object.
+    Signatures are reused within a PRESIGNED_URL_SIGNING_WINDOW time window, so bursts
+    asking for the same object don't recompute the HMAC chain every time.
 
     Args:
-        username (str): User's name.
-        event_date (str): Event date in the format 'YYYY-MM-DD'.
-        event_name (str): Name of the event.
-        event_id (str): Unique event ID.
+        s3_key (str): The key (path) of the object in S3.
 
     Returns:
-        str: The folder path created on S3.
+        str: A pre-signed URL for the object.
     """
-    folder_name = f"{username}/{event_date}/{event_name}/{event_id}/"
+    try:
+        return _sign_presigned_url(s3_key, int(time.time()) // PRESIGNED_URL_SIGNING_WINDOW)
+    except Exception as e:
+        print(f"Error generating pre-signed URL: {e}")
+        return None
 
-    # List of subfolders to create under the event folder
-    subfolders = ["album/", "guest-submissions/", "personalized-albums/"]
-    for subfolder in subfolders:
-        full_path = f"{folder_name}{subfolder}"
-        print(f"Creating folder: {full_path}")
-        s3_client.put_object(
+
+@functools.lru_cache(maxsize=4096)
+def _sign_presigned_url(s3_key, signing_window):
+    """ Sign a GET URL for s3_key - signing_window only partitions the cache; stale windows age out. """
+    if PRESIGNER_ENABLED:
+        return presign_get_url(BUCKET_NAME, s3_key, PRESIGNED_URL_EXPIRATION)
+    return s3_client.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": BUCKET_NAME, "Key": s3_key},
+        ExpiresIn=PRESIGNED_URL_EXPIRATION
+    )
+
+
+def generate_presigned_urls(s3_keys: list) -> list:
+    """
+    Generate pre-signed URLs for many S3 objects at once.
+    URLs signed recently are reused from Redis; the rest are signed in one batch (on the shared
+    thread pool when botocore does the signing) and cached. Redis being unavailable only disables the cache.
+
+    Args:
+        s3_keys (list): The keys (paths) of the objects in S3.
+
+    Returns:
+        list: The pre-signed URLs, in the same order as s3_keys (None where signing failed).
+    """
+    cache_keys = [f"{PRESIGNED_URL_CACHE_KEY_PREFIX}{s3_key}" for s3_key in s3_keys]
+
+    try:
+        urls = redis_client.mget(cache_keys) if cache_keys else []
+    except RedisError as e:
+        print(f"Error reading cached pre-signed URLs: {e}")
+        urls = [None] * len(s3_keys)
+
+    missing = [i for i, url in enumerate(urls) if url is None]
+    if not missing:
+        return urls
+
+    missing_keys = [s3_keys[i] for i in missing]
+    if PRESIGNER_ENABLED:
+        # Microseconds of pure-Python signing per URL - a thread hop would cost more than it saves
+        signed_urls = [generate_presigned_url(s3_key) for s3_key in missing_keys]
+    else:
+        signed_urls = list(s3_executor.map(generate_presigned_url, missing_keys))
+    for i, url in zip(missing, signed_urls):
+        urls[i] = url
+
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for i, url in zip(missing, signed_urls):
+                if url:
+                    pipe.setex(cache_keys[i], PRESIGNED_URL_CACHE_TTL, url)
+            pipe.execute()
+    except RedisError as e:
+        print(f"Error caching pre-signed URLs: {e}")
+
+    return urls
+
+
+def generate_presigned_upload_post(s3_key, content_type, max_size, expiration=3600):
+    """
+    Generate a pre-signed POST (URL + form fields) that lets a client upload an object directly to S3
+    (through the Transfer Acceleration endpoint when it is enabled).
+
+    The content type is baked into the signed policy as a form field, so the client just submits it
+    with the file instead of having to send a matching header. Encryption at rest comes from the
+    bucket's default encryption, so the policy carries no SSE field. S3 itself rejects uploads larger
+    than max_size, before any of the body is stored.
+
+    Args:
+        s3_key (str): The key (path) the object will be uploaded to.
+        content_type (str): The Content-Type of the uploaded object.
+        max_size (int): The maximum size of the uploaded object, in bytes.
+        expiration (int): Seconds until the policy expires.
+
+    Returns:
+        dict: {"url": ..., "fields": {...}} - POST the fields plus a final 'file' field to the URL.
+    """
+    fields = {"Content-Type": content_type}
+    conditions = [["content-length-range", 0, max_size]]
+    try:
+        if PRESIGNER_ENABLED:
+            return presign_post(BUCKET_NAME, s3_key, fields, expiration, accelerate=S3_TRANSFER_ACCELERATION,
+                                conditions=conditions)
+        return s3_upload_client.generate_presigned_post(
             Bucket=BUCKET_NAME,
-            Key=full_path,
-            ServerSideEncryption="aws:kms",  # Optional encryption for the folder
+            Key=s3_key,
+            Fields=fields,
+            Conditions=[{name: value} for name, value in fields.items()] + conditions,
+            ExpiresIn=expiration
         )
+    except Exception as e:
+        raise Exception(f"Error generating pre-signed upload URL: {str(e)}")
 
-    return folder_name
 
+def generate_presigned_multipart_upload(s3_key, content_type, part_count, expiration=3600):
+    """
+    Start a multipart upload and pre-sign a PUT URL for each of its parts, so a client can upload
+    a large file straight to S3 with several parts in flight at once
+    (through the Transfer Acceleration endpoint when it is enabled).
 
-def generate_presigned_url(s3_key):
+    Args:
+        s3_key (str): The key (path) the object will be uploaded to.
+        content_type (str): The Content-Type of the uploaded object.
+        part_count (int): Number of parts (1 - MULTIPART_UPLOAD_MAX_PARTS); all but the last must be >= 5 MB.
+        expiration (int): Seconds until the part URLs expire.
+
+    Returns:
+        dict: {"upload_id": ..., "part_urls": [...]} - part_urls[i] uploads part number i + 1.
+
+    Uploads the client never completes are cleaned up by the bucket's AbortIncompleteMultipartUpload
+    lifecycle rule (see README).
     """
-    Generate a pre-signed URL for accessing an S3 object.
+    try:
+        upload_id = s3_upload_client.create_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=s3_key,
+            ContentType=content_type,
+            ServerSideEncryption=SERVER_SIDE_ENCRYPTION
+        )["UploadId"]
+        part_urls = [
+            s3_upload_client.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": BUCKET_NAME, "Key": s3_key, "UploadId": upload_id, "PartNumber": part_number},
+                ExpiresIn=expiration
+            )
+            for part_number in range(1, part_count + 1)
+        ]
+        return {"upload_id": upload_id, "part_urls": part_urls}
+    except Exception as e:
+        raise Exception(f"Error starting multipart upload: {str(e)}")
+
+
+def complete_multipart_upload(s3_key, upload_id, parts):
+    """
+    Assemble the uploaded parts of a multipart upload into the final object.
+    If S3 rejects the parts, the upload is aborted so its parts don't keep taking up storage.
 
     Args:
-        s3_key (str): The key (path) of the object in S3.
+        s3_key (str): The key (path) of the object.
+        upload_id (str): The ID returned by generate_presigned_multipart_upload.
+        parts (list): (part_number, etag) pairs - the ETag S3 returned for each part upload.
+
+    Raises:
+        ClientError: If the upload could not be completed.
+    """
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": part_number, "ETag": etag}
+                                       for part_number, etag in sorted(parts)]}
+        )
+    except ClientError:
+        try:
+            s3_client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=s3_key, UploadId=upload_id)
+        except ClientError as e:
+            print(f"Error aborting multipart upload {upload_id}: {e}")
+        raise
+
+
+def download_file_to_temp(s3_key):
+    """
+    Download a (potentially large) file from S3 into an anonymous temporary file, in parallel ranged parts
+    fetched by the CRT transfer client.
+
+    Args:
+        s3_key (str): The file's S3 key (path)
 
     Returns:
-        str: A pre-signed URL for the object.
+        file: The temporary file, positioned at the start. Closing it deletes it.
     """
+    temp_file = tempfile.TemporaryFile()
     try:
-        url = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": "photoguests-events", "Key": s3_key},
-            ExpiresIn=3600  # URL expires in 1 hour
+        s3_client.download_fileobj(BUCKET_NAME, s3_key, temp_file, Config=LARGE_TRANSFER_CONFIG)
+    except Exception:
+        temp_file.close()
+        raise
+    temp_file.seek(0)
+    return temp_file
+
+
+def upload_small_file_to_s3(data: bytes, file_name, content_type):
+    """
+    Upload a small in-memory file to S3 with a single PUT, skipping the managed transfer machinery.
+
+    Args:
+        data (bytes): The file content (up to SMALL_UPLOAD_MAX_SIZE).
+        file_name (str): The destination file name in S3.
+        content_type (str): The content type of the file (e.g., 'image/jpeg').
+
+    Returns:
+        bool: True if upload is successful.
+    """
+    try:
+        s3_client.put_object(
+            Bucket=BUCKET_NAME,
+            Key=file_name,
+            Body=data,
+            ContentType=content_type,
+            ServerSideEncryption=SERVER_SIDE_ENCRYPTION
         )
-        return url
+        return True
+    except NoCredentialsError:
+        raise Exception("Credentials not available")
     except Exception as e:
-        print(f"Error generating pre-signed URL: {e}")
-        return None
+        raise Exception(f"Error uploading file: {str(e)}")
 
 
 def upload_file_to_s3(file, file_name, content_type):
     """
-    Upload a file to S3.
+    Upload a (potentially large) file-like object to S3, in parallel parts above SMALL_UPLOAD_MAX_SIZE.
 
     Args:
         file: The file to upload.
@@ -90,8 +310,9 @@ def upload_file_to_s3(file, file_name, content_type):
             file_name,
             ExtraArgs={
                 'ContentType': content_type,
-                'ServerSideEncryption': 'aws:kms'  # Optional encryption for the file
-            }
+                'ServerSideEncryption': SERVER_SIDE_ENCRYPTION
+            },
+            Config=UPLOAD_TRANSFER_CONFIG
         )
         return True
     except NoCredentialsError:
@@ -100,56 +321,168 @@ def upload_file_to_s3(file, file_name, content_type):
         raise Exception(f"Error uploading file: {str(e)}")
 
 
-def append_to_guest_list_in_s3(file_key, guest_submission):
-    """ Append a guest's submission to the existing guest list in S3. """
-    try:
-        try:
-            file_object = s3_client.get_object(Bucket=BUCKET_NAME, Key=file_key)
-            guest_list = json.loads(file_object['Body'].read().decode('utf-8'))
-        except s3_client.exceptions.NoSuchKey:
-            guest_list = []
+def save_guest_submission_to_s3(event_path: str, submission_name: str, guest_submission: dict) -> bool:
+    """
+    Store a single guest submission as its own small JSON object.
 
-        guest_list.append(guest_submission)
+    Every submission gets a unique key, so concurrent guests never read-modify-write
+    a shared file and each submission is a single constant-size PUT. The submission is also
+    written under by-phone/ so a guest can be looked up with one GET.
 
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=file_key,
-            Body=json.dumps(guest_list),
-            ContentType='application/json'
-        )
+    The by-phone entry holds the guest's album UUID, so it is never overwritten: it is written
+    with a conditional PUT (If-None-Match: *), and a phone that already has one is refused.
+    The index entry is written first and removed again if the by-phone entry can't be written,
+    so a failure never leaves a phone claimed by a guest missing from the guest list.
+
+    Args:
+        event_path (str): The event folder path.
+        submission_name (str): Unique name for the submission, e.g. '{phone}_{upload_id}'.
+        guest_submission (dict): The guest's details.
+
+    Returns:
+        bool: True if the submission was saved, False if the phone already has a submission.
+    """
+    body = orjson.dumps(guest_submission)
+    index_key = f"{event_path}guest-submissions/index/{submission_name}.json"
+    by_phone_key = f"{event_path}guest-submissions/by-phone/{guest_submission['phone']}.json"
+    try:
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=index_key, Body=body, ContentType='application/json')
     except Exception as e:
-        print(f"Error appending to guest list in S3: {str(e)}")
+        print(f"Error saving guest submission to S3: {str(e)}")
         raise
 
+    try:
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=by_phone_key, Body=body, ContentType='application/json',
+                             IfNoneMatch="*")
+    except Exception as e:
+        s3_client.delete_object(Bucket=BUCKET_NAME, Key=index_key)
+        if isinstance(e, ClientError) and e.response["Error"]["Code"] in ("PreconditionFailed",
+                                                                          "ConditionalRequestConflict"):
+            return False
+        print(f"Error saving guest submission to S3: {str(e)}")
+        raise
+    return True
+
+
+def object_exists(s3_key: str) -> bool:
+    """ Check whether an object exists in S3 with a single HEAD request. """
+    try:
+        s3_client.head_object(Bucket=BUCKET_NAME, Key=s3_key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def get_submission_guest_uuid(guest_submission: dict):
+    """ Return the album UUID of a guest submission, parsing it from the photo URL for legacy submissions. """
+    guest_uuid = guest_submission.get("guest_uuid")
+    if guest_uuid:
+        return guest_uuid
+    match = PHOTO_URL_GUEST_UUID_RE.match(guest_submission.get("photo_url", ""))
+    return match.group(1) if match else None
+
+
+def _read_json_object(s3_key: str):
+    """ Download and parse a JSON object from S3, returning None if it doesn't exist. """
+    try:
+        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=s3_key)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return orjson.loads(response['Body'].read())
+
+
+def get_guest_submission_by_phone(event_path: str, phone: str):
+    """
+    Fetch the submission a phone number is registered with (the one holding the guest's album UUID)
+    with a single GET.
+
+    Returns:
+        dict: The guest's submission, or None if the phone has no by-phone entry.
+    """
+    return _read_json_object(f"{event_path}guest-submissions/by-phone/{phone}.json")
+
+
+def guest_submission_exists(event_path: str, phone: str) -> bool:
+    """ Check whether a phone number already has a submission, with a single HEAD request. """
+    return object_exists(f"{event_path}guest-submissions/by-phone/{phone}.json")
+
 
 def get_guest_list_from_s3(event_path: str) -> list:
     """
-    Retrieve and parse the guest list JSON from S3.
+    Rebuild the guest list of an event from the per-guest submission objects in S3.
+    Submissions stored in the legacy single guest_list.json file are included as well.
     """
     try:
-        guest_list_key = f"{event_path}guest-submissions/guest_list.json"
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=guest_list_key)
-        guest_data = json.loads(response['Body'].read().decode("utf-8"))
+        index_prefix = f"{event_path}guest-submissions/index/"
+        submission_keys = [
+            item["Key"]
+            for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=index_prefix)
+            for item in page.get("Contents", [])
+        ]
+
+        legacy_guest_list_key = f"{event_path}guest-submissions/guest_list.json"
+        objects = s3_executor.map(_read_json_object, [legacy_guest_list_key] + submission_keys)
+
+        guest_data = next(objects) or []
+        guest_data.extend(submission for submission in objects if submission is not None)
         return guest_data
     except Exception as e:
         print(f"Error fetching guest list: {e}")
         return []
 
 
-def download_file_as_bytes(s3_key):
+def get_cached_guest_list(event_path: str) -> tuple:
+    """
+    Return the guest list of an event, served from the in-process TTL cache when possible.
+    Empty results are not cached so a failed or premature read is retried on the next call.
+
+    Each guest gets a 'guest_uuid' entry, parsed once from its photo_url for legacy submissions.
+
+    Returns:
+        tuple: (guests, index) where index maps (phone, guest_uuid) to the guest's submission.
+               Both are shared between callers and must not be mutated.
+    """
+    with guest_list_cache_lock:
+        cached = guest_list_cache.get(event_path)
+
+    if cached is None:
+        guests = get_guest_list_from_s3(event_path)
+        for guest in guests:
+            guest["guest_uuid"] = get_submission_guest_uuid(guest)
+        index = {(guest.get("phone"), guest["guest_uuid"]): guest for guest in guests}
+        cached = (guests, index)
+        if guests:
+            with guest_list_cache_lock:
+                guest_list_cache[event_path] = cached
+
+    return cached
+
+
+def invalidate_guest_list_cache(event_path: str):
+    """ Drop the cached guest list of an event, e.g. after a new guest submitted. """
+    with guest_list_cache_lock:
+        guest_list_cache.pop(event_path, None)
+
+
+def stream_file_from_s3(s3_key, chunk_size=1024 * 1024):
     """
-    Download a file from S3 and return its content as bytes.
+    Open a file in S3 for streaming, without buffering the whole object in memory.
+    The GET is issued right away, so a missing object raises here rather than mid-stream.
 
     Args:
         s3_key (str): The file's S3 key (path)
+        chunk_size (int): Size of the chunks yielded by the iterator.
 
     Returns:
-        bytes: The content of the file.
+        tuple: (chunks, content_length) - a blocking iterator over the file's bytes and its size.
+
+    Raises:
+        s3_client.exceptions.NoSuchKey: If the file doesn't exist.
     """
     try:
         file_object = s3_client.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-        return file_object['Body'].read()
     except NoCredentialsError:
         raise Exception("Credentials not available")
-    except Exception as e:
-        raise Exception(f"Error downloading file from S3: {str(e)}")
+    return file_object['Body'].iter_chunks(chunk_size), file_object['ContentLength']
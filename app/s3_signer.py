@@ -0,0 +1,139 @@
+import base64
+import functools
+import hashlib
+import hmac
+import time
+from urllib.parse import quote
+
+import orjson
+
+from .aws_clients import AWS_CREDENTIALS
+
+SIGNING_ALGORITHM = "AWS4-HMAC-SHA256"
+
+# The fast path needs static credentials and a region; otherwise callers fall back to botocore
+PRESIGNER_ENABLED = all(AWS_CREDENTIALS)
+
+# SigV4 signing keys only depend on the date (region and service are fixed), so the signing material
+# of a day - key, credential scope and the encoded X-Amz-Credential value - is derived once
+_daily_signing_material = {}
+
+
+def _get_daily_signing_material(datestamp: str) -> tuple:
+    """
+    Return (signing_key, credential_scope, encoded_credential) for a 'YYYYMMDD' date,
+    deriving them on the first request of the day.
+    """
+    material = _daily_signing_material.get(datestamp)
+    if material is None:
+        signing_key = ("AWS4" + AWS_CREDENTIALS.secret_key).encode()
+        for part in (datestamp, AWS_CREDENTIALS.region, "s3", "aws4_request"):
+            signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+        credential_scope = f"{datestamp}/{AWS_CREDENTIALS.region}/s3/aws4_request"
+        material = (signing_key, credential_scope, quote(f"{AWS_CREDENTIALS.access_key}/{credential_scope}", safe=""))
+        _daily_signing_material.clear()  # Material of previous days is never needed again
+        _daily_signing_material[datestamp] = material
+    return material
+
+
+# The X-Amz-Date timestamp has one-second resolution, so it is formatted at most once per second
+_amz_date = (0, "")
+
+
+def _get_amz_date() -> str:
+    """ Return the current UTC time as 'YYYYMMDDTHHMMSSZ'. """
+    global _amz_date
+    now = int(time.time())
+    cached = _amz_date
+    if now != cached[0]:
+        _amz_date = cached = (now, time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now)))
+    return cached[1]
+
+
+@functools.lru_cache(maxsize=8)
+def _bucket_endpoint(bucket: str) -> tuple:
+    """ Return the bucket's regional virtual-hosted host and the fixed tail of its canonical requests. """
+    host = f"{bucket}.s3.{AWS_CREDENTIALS.region}.amazonaws.com"
+    # Only 'host' is signed; query-signed S3 requests don't sign the body
+    return host, f"\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+
+
+def presign_get_url(bucket: str, key: str, expires_in: int = 3600) -> str:
+    """
+    Generate a pre-signed GET URL for an S3 object with SigV4 query authentication.
+
+    A stripped-down equivalent of s3_client.generate_presigned_url("get_object", ...): no endpoint
+    resolution or service model work per call - just the canonical request, one SHA-256 and one HMAC.
+
+    Args:
+        bucket (str): The bucket name.
+        key (str): The key (path) of the object in S3.
+        expires_in (int): Seconds until the URL expires.
+
+    Returns:
+        str: A pre-signed URL for the object.
+    """
+    amz_date = _get_amz_date()
+    signing_key, credential_scope, encoded_credential = _get_daily_signing_material(amz_date[:8])
+    host, canonical_request_tail = _bucket_endpoint(bucket)
+
+    canonical_uri = "/" + quote(key)
+    canonical_query = (
+        f"X-Amz-Algorithm={SIGNING_ALGORITHM}"
+        f"&X-Amz-Credential={encoded_credential}"
+        f"&X-Amz-Date={amz_date}"
+        f"&X-Amz-Expires={expires_in}"
+        f"&X-Amz-SignedHeaders=host"
+    )
+
+    canonical_request = f"GET\n{canonical_uri}\n{canonical_query}{canonical_request_tail}"
+    string_to_sign = (
+        f"{SIGNING_ALGORITHM}\n{amz_date}\n{credential_scope}\n"
+        f"{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+    )
+    signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    return f"https://{host}{canonical_uri}?{canonical_query}&X-Amz-Signature={signature}"
+
+
+def presign_post(bucket: str, key: str, fields: dict, expires_in: int = 3600, accelerate: bool = False,
+                 conditions: list = ()) -> dict:
+    """
+    Generate a pre-signed POST (URL + form fields) for uploading an object with SigV4 POST policy signing.
+
+    The policy pins the bucket, the key and every given form field to its exact value, plus any extra conditions.
+    Equivalent to s3_client.generate_presigned_post(...) with matching Fields and Conditions.
+
+    Args:
+        bucket (str): The bucket name.
+        key (str): The key (path) the object will be uploaded to.
+        fields (dict): Extra form fields the upload must carry, e.g. {"Content-Type": "image/jpeg"}.
+        expires_in (int): Seconds until the policy expires.
+        accelerate (bool): Whether to upload through the Transfer Acceleration endpoint.
+        conditions (list): Extra policy conditions, e.g. [["content-length-range", 0, 1048576]].
+
+    Returns:
+        dict: {"url": ..., "fields": {...}} - POST the fields plus a final 'file' field to the URL.
+    """
+    amz_date = _get_amz_date()
+    signing_key, credential_scope, _ = _get_daily_signing_material(amz_date[:8])
+    host = f"{bucket}.s3-accelerate.amazonaws.com" if accelerate else _bucket_endpoint(bucket)[0]
+
+    signed_fields = {
+        **fields,
+        "x-amz-algorithm": SIGNING_ALGORITHM,
+        "x-amz-credential": f"{AWS_CREDENTIALS.access_key}/{credential_scope}",
+        "x-amz-date": amz_date,
+    }
+    policy = orjson.dumps({
+        "expiration": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + expires_in)),
+        "conditions": [{"bucket": bucket}, {"key": key}] + [{name: value} for name, value in signed_fields.items()]
+                      + list(conditions),
+    })
+    encoded_policy = base64.b64encode(policy).decode()
+    signature = hmac.new(signing_key, encoded_policy.encode(), hashlib.sha256).hexdigest()
+
+    return {
+        "url": f"https://{host}/",
+        "fields": {"key": key, **signed_fields, "policy": encoded_policy, "x-amz-signature": signature},
+    }
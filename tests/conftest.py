@@ -0,0 +1,4 @@
+import os
+
+# app.aws_clients builds its clients at import time, which needs a region even when .env has none
+os.environ.setdefault("AWS_REGION", "eu-west-1")
@@ -0,0 +1,109 @@
+"""
+Compare the hand-rolled SigV4 presigner (app/s3_signer.py) with botocore at a fixed time,
+so a change to either one can't silently produce URLs or POST policies S3 would reject.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import time
+import types
+from urllib.parse import parse_qs, urlsplit
+
+import boto3
+import botocore.auth
+import botocore.signers
+import orjson
+import pytest
+from botocore.config import Config
+
+from app import s3_signer
+from app.aws_clients import AwsCredentials
+
+CREDENTIALS = AwsCredentials(
+    access_key="AKIDEXAMPLE",
+    secret_key="wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY",
+    region="eu-west-1"
+)
+BUCKET = "photoguests-events"
+FIXED_NOW = datetime.datetime(2026, 10, 16, 12, 34, 56, tzinfo=datetime.timezone.utc)
+
+KEYS = [
+    "user@example.com/2026-10-16/חתונה של דנה/1b4e28ba/album/1.jpg",
+    "a b/c+d/e~f(1).png",
+    "x/y%z&=.jpg",
+]
+
+
+@pytest.fixture(autouse=True)
+def fixed_signer(monkeypatch):
+    """ Sign with known credentials at FIXED_NOW, in both the presigner and botocore. """
+    monkeypatch.setattr(s3_signer, "AWS_CREDENTIALS", CREDENTIALS)
+    monkeypatch.setattr(s3_signer, "time", types.SimpleNamespace(
+        time=FIXED_NOW.timestamp, strftime=time.strftime, gmtime=time.gmtime))
+    monkeypatch.setattr(s3_signer, "_amz_date", (0, ""))
+    s3_signer._daily_signing_material.clear()
+    s3_signer._bucket_endpoint.cache_clear()
+
+    fixed_datetime = lambda remove_tzinfo=True: FIXED_NOW.replace(tzinfo=None) if remove_tzinfo else FIXED_NOW
+    monkeypatch.setattr(botocore.auth, "get_current_datetime", fixed_datetime)
+    monkeypatch.setattr(botocore.signers, "get_current_datetime", fixed_datetime)
+    yield
+    s3_signer._daily_signing_material.clear()
+    s3_signer._bucket_endpoint.cache_clear()
+
+
+def _botocore_client(accelerate=False):
+    session = boto3.Session(
+        aws_access_key_id=CREDENTIALS.access_key,
+        aws_secret_access_key=CREDENTIALS.secret_key,
+        region_name=CREDENTIALS.region
+    )
+    return session.client("s3", config=Config(signature_version="s3v4", s3={
+        "addressing_style": "virtual",
+        "us_east_1_regional_endpoint": "regional",
+        "use_accelerate_endpoint": accelerate,
+    }))
+
+
+@pytest.mark.parametrize("key", KEYS)
+def test_presign_get_url_matches_botocore(key):
+    expected = _botocore_client().generate_presigned_url(
+        "get_object", Params={"Bucket": BUCKET, "Key": key}, ExpiresIn=3600)
+    url = s3_signer.presign_get_url(BUCKET, key, 3600)
+
+    expected_parts, parts = urlsplit(expected), urlsplit(url)
+    assert (parts.scheme, parts.netloc, parts.path) == (expected_parts.scheme, expected_parts.netloc,
+                                                        expected_parts.path)
+    # Same parameters, including X-Amz-Signature
+    assert parse_qs(parts.query) == parse_qs(expected_parts.query)
+
+
+@pytest.mark.parametrize("accelerate", [False, True])
+def test_presign_post_matches_botocore(accelerate):
+    key = "user@example.com/2026-10-16/חתונה/1b4e28ba/guest-submissions/0501234567_ab12.jpg"
+    fields = {"Content-Type": "image/jpeg"}
+    conditions = [["content-length-range", 0, 25 * 1024 * 1024]]
+
+    expected = _botocore_client(accelerate).generate_presigned_post(
+        BUCKET, key, Fields=dict(fields), Conditions=[{"Content-Type": "image/jpeg"}] + conditions, ExpiresIn=3600)
+    post = s3_signer.presign_post(BUCKET, key, fields, 3600, accelerate=accelerate, conditions=conditions)
+
+    assert post["url"] == expected["url"]
+    assert post["fields"].keys() == expected["fields"].keys()
+    for name in expected["fields"].keys() - {"policy", "x-amz-signature"}:
+        assert post["fields"][name] == expected["fields"][name]
+
+    # The policies may serialize differently, but must state the same expiration and conditions
+    policy = orjson.loads(base64.b64decode(post["fields"]["policy"]))
+    expected_policy = orjson.loads(base64.b64decode(expected["fields"]["policy"]))
+    canonical = lambda conds: sorted(orjson.dumps(condition, option=orjson.OPT_SORT_KEYS) for condition in conds)
+    assert policy["expiration"] == expected_policy["expiration"]
+    assert canonical(policy["conditions"]) == canonical(expected_policy["conditions"])
+
+    # Signing botocore's policy with the presigner's key must reproduce botocore's signature,
+    # and the presigner's own signature must be the same HMAC over its policy
+    signing_key, _, _ = s3_signer._get_daily_signing_material(FIXED_NOW.strftime("%Y%m%d"))
+    sign = lambda encoded_policy: hmac.new(signing_key, encoded_policy.encode(), hashlib.sha256).hexdigest()
+    assert sign(expected["fields"]["policy"]) == expected["fields"]["x-amz-signature"]
+    assert sign(post["fields"]["policy"]) == post["fields"]["x-amz-signature"]